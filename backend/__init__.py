@@ -0,0 +1,2 @@
+# Legacy import path; the app lives in the top-level main.py
+from main import *  # noqa: F401,F403
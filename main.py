@@ -1,39 +1,239 @@
+import asyncio
 import os
-import random
+import re
 import uuid
-from typing import Dict, List
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import List, Optional, Sequence, Set, Tuple, Union
 
-from fastapi import FastAPI, HTTPException
+import httpx
+import orjson
+import redis.asyncio as aioredis
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-from schemas import Project, Script, ScriptSegment, MediaAsset, RenderJob
+from schemas import Fandom, Mode, Project, Script, ScriptSegment, MediaAsset
+from store import MemoryStore, RedisStore, project_channel
+from tasks import (
+    FANDOM_TABLE,
+    REDIS_URL,
+    SD_API_URL,
+    SD_TIMEOUT,
+    TTS_API_URL,
+    ai_images_task,
+    build_image_assets,
+    build_script,
+    build_voice_asset,
+    generate_script_task,
+    placeholder_images,
+    sd_request,
+    sd_urls,
+    tts_request,
+    tts_url,
+    voice_task,
+)
+
+# Most prompts sent upstream in one diffusion call; also caps AIImagesReq.prompts
+MAX_IMAGE_BATCH = 16
+
+def _blames_input(exc: Exception) -> bool:
+    """True if a failed call points at its prompts rather than at the provider"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.is_client_error
+    return isinstance(exc, ValueError)
+
+class ImageBatcher:
+    """Coalesces prompts from concurrent requests into one upstream diffusion call.
+
+    Requests are collected for up to ``max_wait`` seconds (or until ``max_batch``
+    prompts are pending) and then flushed as a single batched POST. A request
+    never shares a flush that would take it past ``max_batch``. If a shared flush
+    is rejected for its input (4xx or a bad body) each request is retried alone so
+    one bad request only fails itself; provider outages (5xx, timeouts, connect
+    errors) fail the whole batch rather than multiplying upstream calls.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, max_wait: float = 0.05, max_batch: int = MAX_IMAGE_BATCH):
+        self.client = client
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+        # Item taken off the queue that did not fit in the previous flush
+        self._carry: Optional[Tuple[Sequence[str], asyncio.Future]] = None
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+        for task in [self._worker, *self._flushes]:
+            if task:
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+    async def submit(self, prompts: Sequence[str]) -> List[str]:
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((prompts, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first, self._carry = self._carry or await self.queue.get(), None
+            pending = [first]
+            size = len(first[0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if size + len(item[0]) > self.max_batch:
+                    self._carry = item
+                    break
+                pending.append(item)
+                size += len(item[0])
+            task = asyncio.create_task(self._flush(pending))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, pending: List[Tuple[Sequence[str], asyncio.Future]]):
+        prompts = [p for batch, _ in pending for p in batch]
+        try:
+            urls = await self._request(prompts)
+        except Exception as exc:
+            if len(pending) > 1 and _blames_input(exc):
+                # Isolate the failing request instead of failing everyone in the batch
+                await asyncio.gather(*(self._flush([item]) for item in pending))
+                return
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        i = 0
+        for batch, fut in pending:
+            if not fut.done():
+                fut.set_result(urls[i:i + len(batch)])
+            i += len(batch)
+
+    async def _request(self, prompts: Sequence[str]) -> List[str]:
+        # Only a single oversized request can exceed max_batch; split it upstream
+        chunks = [prompts[i:i + self.max_batch] for i in range(0, len(prompts), self.max_batch)]
+        results = await asyncio.gather(*(request_images(self.client, chunk) for chunk in chunks))
+        return [url for urls in results for url in urls]
+
+
+async def request_images(client: httpx.AsyncClient, prompts: Sequence[str]) -> List[str]:
+    """One batched POST to the diffusion backend"""
+    payload, headers = sd_request(prompts)
+    resp = await client.post(SD_API_URL, json=payload, headers=headers, timeout=SD_TIMEOUT)
+    resp.raise_for_status()
+    return sd_urls(resp.json(), len(prompts))
+
+
+# Shared outbound client and image batcher, created in the app lifespan
+http_client: Optional[httpx.AsyncClient] = None
+image_batcher: Optional[ImageBatcher] = None
+# Redis for shared state; only set when REDIS_URL is configured
+redis_client: Optional[aioredis.Redis] = None
+# Separate pool for /ws pub/sub, which pins one connection per open socket,
+# so browser tabs can never starve the store of connections
+pubsub_client: Optional[aioredis.Redis] = None
+# Project state; swapped for a RedisStore in the lifespan when REDIS_URL is set
+store: Union[MemoryStore, RedisStore] = MemoryStore()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, image_batcher, redis_client, pubsub_client, store
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=httpx.Timeout(10.0, connect=3.0),
+        http2=True,
+    )
+    image_batcher = ImageBatcher(http_client)
+    image_batcher.start()
+    if REDIS_URL:
+        redis_client = aioredis.Redis.from_pool(aioredis.ConnectionPool.from_url(REDIS_URL, max_connections=100))
+        store = RedisStore(redis_client)
+        pubsub_client = aioredis.Redis.from_pool(aioredis.ConnectionPool.from_url(REDIS_URL, max_connections=1000))
+    try:
+        yield
+    finally:
+        await image_batcher.stop()
+        await http_client.aclose()
+        if redis_client is not None:
+            await redis_client.aclose()
+        if pubsub_client is not None:
+            await pubsub_client.aclose()
+        image_batcher = None
+        http_client = None
+        redis_client = None
+        pubsub_client = None
+        store = MemoryStore()
 
-app = FastAPI(title="AI Shorts Studio API")
+async def get_client() -> httpx.AsyncClient:
+    # Dependency so tests can swap in a mock via app.dependency_overrides
+    if http_client is None:
+        raise HTTPException(status_code=503, detail="HTTP client not initialised")
+    return http_client
 
+async def get_image_batcher() -> ImageBatcher:
+    # Dependency so tests can swap in a fake via app.dependency_overrides
+    if image_batcher is None:
+        raise HTTPException(status_code=503, detail="Image batcher not initialised")
+    return image_batcher
+
+app = FastAPI(title="AI Shorts Studio API", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# CORS: either one explicit frontend origin (with credentials) or a plain wildcard
+frontend_url = os.getenv("FRONTEND_URL", "*")
+allow_any_origin = frontend_url == "*"
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=["*"] if allow_any_origin else [frontend_url],
+    allow_credentials=not allow_any_origin,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# In-memory MVP stores
-PROJECTS: Dict[str, Project] = {}
-SCRIPTS: Dict[str, Script] = {}
-ASSETS: Dict[str, List[MediaAsset]] = {}
-RENDERS: Dict[str, RenderJob] = {}
+# Non-empty runs between line breaks, for script segmentation
+_LINE_RE = re.compile(r"[^\r\n]+")
+
+def _compute_segment_times(n: int, dur: int = 55) -> Tuple[Tuple[float, float], ...]:
+    """(start, end) for n equal slots across ~dur seconds, clamped to dur"""
+    per = max(1, dur // max(1, n))
+    return tuple((float(t), float(min(dur, t + per))) for t in range(0, n * per, per))
+
+# n is client-controlled, so only the small, common tables are kept around
+_SEGMENT_CACHE_MAX_N = 64
+_cached_segment_times = lru_cache(maxsize=_SEGMENT_CACHE_MAX_N)(_compute_segment_times)
+
+def _segment_times(n: int) -> Tuple[Tuple[float, float], ...]:
+    if n <= _SEGMENT_CACHE_MAX_N:
+        return _cached_segment_times(n)
+    return _compute_segment_times(n)
 
 class CreateProjectReq(BaseModel):
     title: str
     topic: str
-    mode: str = "auto"
-    fandom: str = "generic"
+    mode: Mode = "auto"
+    fandom: Fandom = "generic"
+    brand_name: Optional[str] = None
 
 class ScriptGenerateReq(BaseModel):
     project_id: str
-    topic: str
+    topic: Optional[str] = None  # defaults to the project topic
 
 class ScriptProvideReq(BaseModel):
     project_id: str
@@ -42,130 +242,194 @@ class ScriptProvideReq(BaseModel):
 class AIImagesReq(BaseModel):
     project_id: str
     fandom: str = "generic"
+    # defaults to the fandom's prompt set; capped at one upstream batch
+    prompts: Optional[List[str]] = Field(default=None, min_length=1, max_length=MAX_IMAGE_BATCH)
+    stream: bool = False  # NDJSON, one asset per line as each image is ready (inline mode only)
 
 class VoiceReq(BaseModel):
     project_id: str
+    voice: str = "female_neutral"
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "AI Shorts Studio Backend running"}
 
 @app.post("/project")
-def create_project(req: CreateProjectReq):
+async def create_project(req: CreateProjectReq):
     pid = str(uuid.uuid4())
-    project = Project(title=req.title, topic=req.topic, mode=req.mode, fandom=req.fandom)
-    PROJECTS[pid] = project
+    project = Project(title=req.title, topic=req.topic, mode=req.mode, fandom=req.fandom, brand_name=req.brand_name)
+    await store.create_project(pid, project)
     return {"project_id": pid}
 
 @app.get("/project/{project_id}")
-def get_project(project_id: str):
-    project = PROJECTS.get(project_id)
-    if not project:
+async def get_project(project_id: str, request: Request):
+    snapshot = await store.snapshot(project_id)
+    if snapshot is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    script = SCRIPTS.get(project_id)
-    assets = ASSETS.get(project_id, [])
-    render = RENDERS.get(project_id)
-    return {"project": project, "script": script, "assets": assets, "render": render}
+    version, body = snapshot
+    etag = f'W/"{project_id}-{version}"'
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 @app.post("/script/generate")
-def generate_script(req: ScriptGenerateReq):
-    if req.project_id not in PROJECTS:
+async def generate_script(req: ScriptGenerateReq):
+    project = await store.get_project(req.project_id)
+    if project is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    # Simple templated script 45-60s
-    bullets = [
-        "Hook: a jaw-dropping reveal in 5 seconds",
-        "Point 1: surprising lore detail",
-        "Point 2: fan theory twist",
-        "Point 3: what most fans miss",
-        "CTA: follow for more in-universe secrets"
-    ]
-    text = (f"Topic: {req.topic}\n" + "\n".join(f"- {b}" for b in bullets))
-    # Segments across ~55s
-    segments = [
-        ScriptSegment(start=0.0, end=5.0, text="Hook"),
-        ScriptSegment(start=5.0, end=20.0, text="Point 1"),
-        ScriptSegment(start=20.0, end=35.0, text="Point 2"),
-        ScriptSegment(start=35.0, end=50.0, text="Point 3"),
-        ScriptSegment(start=50.0, end=58.0, text="CTA"),
-    ]
-    script = Script(project_id=req.project_id, text=text, segments=segments)
-    SCRIPTS[req.project_id] = script
+    topic = req.topic or project.topic
+    if redis_client is not None:
+        # .delay() is a blocking broker publish; keep it off the event loop
+        task = await run_in_threadpool(generate_script_task.delay, req.project_id, topic)
+        return {"ok": True, "task_id": task.id}
+    await store.set_script(req.project_id, build_script(req.project_id, topic))
     return {"ok": True}
 
 @app.post("/script/provide")
-def provide_script(req: ScriptProvideReq):
-    if req.project_id not in PROJECTS:
+async def provide_script(req: ScriptProvideReq):
+    if not await store.exists(req.project_id):
         raise HTTPException(status_code=404, detail="Project not found")
-    # naive segmentation: split by lines
-    lines = [l.strip() for l in req.text.splitlines() if l.strip()]
-    dur = 55
-    per = max(1, dur // max(1, len(lines)))
-    t = 0
-    segs = []
-    for l in lines:
-        segs.append(ScriptSegment(start=float(t), end=float(min(dur, t+per)), text=l))
-        t += per
-    script = Script(project_id=req.project_id, text=req.text, segments=segs)
-    SCRIPTS[req.project_id] = script
+    # naive segmentation: one segment per non-blank line, in a single scan
+    lines = [l for l in (m.group().strip() for m in _LINE_RE.finditer(req.text)) if l]
+    # inputs were validated by ScriptProvideReq, so skip re-validation
+    segs = [
+        ScriptSegment.model_construct(start=start, end=end, text=l)
+        for (start, end), l in zip(_segment_times(len(lines)), lines)
+    ]
+    script = Script.model_construct(project_id=req.project_id, text=req.text, segments=segs)
+    await store.set_script(req.project_id, script)
     return {"ok": True}
 
-HP_GIFS = [
-    "https://media.tenor.com/1.gif",
-    "https://media.tenor.com/2.gif",
-    "https://media.tenor.com/3.gif",
-]
-GOT_GIFS = [
-    "https://media.tenor.com/a.gif",
-    "https://media.tenor.com/b.gif",
-    "https://media.tenor.com/c.gif",
-]
-GENERIC_GIFS = [
-    "https://media.tenor.com/x.gif",
-    "https://media.tenor.com/y.gif",
-    "https://media.tenor.com/z.gif",
-]
-
 @app.post("/assets/ai-images")
-def ai_images(req: AIImagesReq):
-    if req.project_id not in PROJECTS:
+async def ai_images(
+    req: AIImagesReq,
+    batcher: ImageBatcher = Depends(get_image_batcher),
+    client: httpx.AsyncClient = Depends(get_client),
+):
+    if not await store.exists(req.project_id):
         raise HTTPException(status_code=404, detail="Project not found")
+    if redis_client is not None:
+        if req.stream:
+            raise HTTPException(status_code=400, detail="stream is not available for queued generation; use /ws/{project_id}")
+        task = await run_in_threadpool(ai_images_task.delay, req.project_id, req.fandom, req.prompts)
+        return {"ok": True, "task_id": task.id}
     fandom = req.fandom
-    pool = GENERIC_GIFS
-    prompts = []
-    if fandom == "harry_potter":
-        pool = HP_GIFS
-        prompts = ["wand sparks", "hogwarts castle night", "patronus mist"]
-    elif fandom == "game_of_thrones":
-        pool = GOT_GIFS
-        prompts = ["dragon flight", "winterfell snow drift", "sword sparks"]
+    pool, prompts = FANDOM_TABLE.get(fandom, FANDOM_TABLE["generic"])
+    prompts = req.prompts or prompts
+    if req.stream:
+        return StreamingResponse(_stream_images(req.project_id, fandom, pool, prompts, client), media_type="application/x-ndjson")
+    if SD_API_URL:
+        try:
+            picked = await batcher.submit(prompts)
+        except (httpx.HTTPError, KeyError, ValueError):
+            raise HTTPException(status_code=502, detail="Image provider error")
     else:
-        prompts = ["magic particles", "fantasy landscape", "mystic smoke"]
-
-    picked = random.sample(pool, k=min(3, len(pool)))
-    assets = [
-        MediaAsset(project_id=req.project_id, kind="image", url=url, meta={"prompt": p, "fandom": fandom})
-        for url, p in zip(picked, prompts)
-    ]
-    ASSETS.setdefault(req.project_id, [])
-    ASSETS[req.project_id].extend(assets)
+        picked = placeholder_images(pool)
+    assets = build_image_assets(req.project_id, fandom, picked, prompts)
+    await store.add_assets(req.project_id, assets)
     return {"count": len(assets)}
 
+async def _stream_images(project_id: str, fandom: str, pool: Sequence[str], prompts: Sequence[str], client: httpx.AsyncClient):
+    async def one(prompt: str) -> Tuple[str, Optional[MediaAsset]]:
+        try:
+            urls = await request_images(client, [prompt])
+        except (httpx.HTTPError, KeyError, ValueError):
+            return prompt, None
+        return prompt, build_image_assets(project_id, fandom, urls, [prompt])[0]
+
+    if not SD_API_URL:
+        for asset in build_image_assets(project_id, fandom, placeholder_images(pool), prompts):
+            await store.add_assets(project_id, [asset])
+            yield orjson.dumps(asset.model_dump(mode="json")) + b"\n"
+        return
+    # One upstream call per prompt, bypassing the batcher, so each line goes out
+    # as soon as its own image is ready rather than when the whole batch is.
+    # A failed prompt gets its own error line and the rest keep streaming.
+    pending = [asyncio.ensure_future(one(p)) for p in prompts]
+    try:
+        for fut in asyncio.as_completed(pending):
+            prompt, asset = await fut
+            if asset is None:
+                # Headers are already sent, so report the failure in-band
+                yield orjson.dumps({"prompt": prompt, "error": "Image provider error"}) + b"\n"
+                continue
+            await store.add_assets(project_id, [asset])
+            yield orjson.dumps(asset.model_dump(mode="json")) + b"\n"
+    finally:
+        # Every call is done unless the client disconnected; drop any still in flight
+        for fut in pending:
+            fut.cancel()
+
 @app.post("/assets/voice")
-def voice(req: VoiceReq):
-    if req.project_id not in PROJECTS:
+async def voice(req: VoiceReq, client: httpx.AsyncClient = Depends(get_client)):
+    if not await store.exists(req.project_id):
         raise HTTPException(status_code=404, detail="Project not found")
-    # placeholder TTS
-    tts_url = "https://cdn.pixabay.com/download/audio/2022/02/23/audio_6b3c.mp3?filename=neutral-female-voiceover-sample.mp3"
-    asset = MediaAsset(project_id=req.project_id, kind="voice", url=tts_url, meta={"voice": "female_neutral", "lang": "en-US"})
-    ASSETS.setdefault(req.project_id, [])
-    ASSETS[req.project_id].append(asset)
+    text = None
+    if TTS_API_URL:
+        script = await store.get_script(req.project_id)
+        if script is None:
+            raise HTTPException(status_code=400, detail="Script missing")
+        text = script.text
+    if redis_client is not None:
+        task = await run_in_threadpool(voice_task.delay, req.project_id, req.voice, text)
+        return {"ok": True, "task_id": task.id}
+    url = None
+    if TTS_API_URL:
+        payload, headers = tts_request(text, req.voice)
+        try:
+            resp = await client.post(TTS_API_URL, json=payload, headers=headers)
+            resp.raise_for_status()
+            url = tts_url(resp.json())
+        except (httpx.HTTPError, KeyError, ValueError):
+            raise HTTPException(status_code=502, detail="Voice provider error")
+    asset = build_voice_asset(req.project_id, req.voice, url)
+    await store.add_assets(req.project_id, [asset])
     return {"ok": True}
 
+# =============================================================================
+# TASK NOTIFICATIONS
+# =============================================================================
+
+@app.websocket("/ws/{project_id}")
+async def project_events(websocket: WebSocket, project_id: str):
+    await websocket.accept()
+    if pubsub_client is None:
+        # Nothing is queued without a broker; every endpoint completes inline
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR, reason="Task notifications require REDIS_URL")
+        return
+    pubsub = pubsub_client.pubsub()
+    await pubsub.subscribe(project_channel(project_id))
+    # Race the socket against the channel so a disconnect is seen even when nothing is published
+    receive = asyncio.ensure_future(websocket.receive())
+    message = asyncio.ensure_future(pubsub.get_message(ignore_subscribe_messages=True, timeout=None))
+    try:
+        while True:
+            done, _ = await asyncio.wait({receive, message}, return_when=asyncio.FIRST_COMPLETED)
+            if receive in done:
+                if receive.result()["type"] == "websocket.disconnect":
+                    break
+                # Client messages carry no meaning here; keep listening
+                receive = asyncio.ensure_future(websocket.receive())
+            if message in done:
+                msg = message.result()
+                if msg is not None:
+                    await websocket.send_text(msg["data"].decode())
+                message = asyncio.ensure_future(pubsub.get_message(ignore_subscribe_messages=True, timeout=None))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receive.cancel()
+        message.cancel()
+        await pubsub.aclose()
+
 @app.get("/health")
-def health():
+async def health():
     return {"ok": True}
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Without REDIS_URL the stores are in-process dicts, so default to a single worker.
+    # Production: gunicorn -k uvicorn.workers.UvicornWorker -w N main:app
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() if REDIS_URL else 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools", workers=workers)
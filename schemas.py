@@ -15,6 +15,7 @@ class Project(BaseModel):
     use_ai_images: bool = True
     use_stock_media: bool = False
     use_ai_voice: bool = True
+    brand_name: Optional[str] = None
     brand_primary: str = "#FACC15"  # yellow-400
     brand_secondary: str = "#18181B"  # zinc-900
     fps: int = 30
@@ -0,0 +1,141 @@
+"""
+Project state stores
+
+MemoryStore keeps everything in process (single API worker, the MVP default).
+RedisStore keeps each project in one hash so any number of API workers share it:
+    proj:{id} -> project, script, assets, render (orjson blobs), version
+
+Both bump a per-project version on every write (it drives the ETag) and hand
+out the GET /project body pre-serialized, so reads never go through Pydantic.
+"""
+
+from collections import defaultdict
+from typing import DefaultDict, Dict, List, Optional, Tuple
+
+import orjson
+import redis.asyncio as aioredis
+from pydantic import BaseModel
+
+from schemas import Project, Script, MediaAsset, RenderJob
+
+def project_channel(project_id: str) -> str:
+    """Redis pub/sub channel carrying task notifications for a project"""
+    return f"project:{project_id}"
+
+def _dump(model: BaseModel) -> bytes:
+    return orjson.dumps(model.model_dump(mode="json"))
+
+class MemoryStore:
+    """In-process dicts; only valid with a single API worker"""
+
+    def __init__(self):
+        self.projects: Dict[str, Project] = {}
+        self.scripts: Dict[str, Script] = {}
+        self.assets: DefaultDict[str, List[MediaAsset]] = defaultdict(list)
+        self.renders: Dict[str, RenderJob] = {}
+        self.versions: Dict[str, int] = {}
+        # Pre-serialized GET /project body, rebuilt on write
+        self.serialized: Dict[str, bytes] = {}
+
+    def _invalidate(self, project_id: str):
+        """Call after any write to a project's state"""
+        self.versions[project_id] = self.versions.get(project_id, 0) + 1
+        script = self.scripts.get(project_id)
+        render = self.renders.get(project_id)
+        self.serialized[project_id] = orjson.dumps({
+            "project": self.projects[project_id].model_dump(mode="json"),
+            "script": script.model_dump(mode="json") if script else None,
+            "assets": [a.model_dump(mode="json") for a in self.assets.get(project_id, [])],
+            "render": render.model_dump(mode="json") if render else None,
+        })
+
+    async def exists(self, project_id: str) -> bool:
+        return project_id in self.projects
+
+    async def create_project(self, project_id: str, project: Project):
+        self.projects[project_id] = project
+        self._invalidate(project_id)
+
+    async def get_project(self, project_id: str) -> Optional[Project]:
+        return self.projects.get(project_id)
+
+    async def get_script(self, project_id: str) -> Optional[Script]:
+        return self.scripts.get(project_id)
+
+    async def set_script(self, project_id: str, script: Script):
+        self.scripts[project_id] = script
+        self._invalidate(project_id)
+
+    async def add_assets(self, project_id: str, assets: List[MediaAsset]):
+        self.assets[project_id].extend(assets)
+        self._invalidate(project_id)
+
+    async def snapshot(self, project_id: str) -> Optional[Tuple[int, bytes]]:
+        """Return (version, serialized body) or None if the project is unknown"""
+        if project_id not in self.projects:
+            return None
+        return self.versions[project_id], self.serialized[project_id]
+
+# Splices comma-joined asset blobs (ARGV[1]) into the stored JSON array and
+# bumps the version, atomically, so concurrent workers never lose an append.
+_APPEND_ASSETS = """
+local cur = redis.call('HGET', KEYS[1], 'assets')
+if not cur or cur == '[]' then
+  cur = '[' .. ARGV[1] .. ']'
+else
+  cur = string.sub(cur, 1, -2) .. ',' .. ARGV[1] .. ']'
+end
+redis.call('HSET', KEYS[1], 'assets', cur)
+return redis.call('HINCRBY', KEYS[1], 'version', 1)
+"""
+
+class RedisStore:
+    """One Redis hash per project, shared by every API worker"""
+
+    def __init__(self, redis: aioredis.Redis):
+        self.redis = redis
+        self._append_assets = redis.register_script(_APPEND_ASSETS)
+
+    @staticmethod
+    def _key(project_id: str) -> str:
+        return f"proj:{project_id}"
+
+    async def exists(self, project_id: str) -> bool:
+        return bool(await self.redis.hexists(self._key(project_id), "project"))
+
+    async def create_project(self, project_id: str, project: Project):
+        await self.redis.hset(self._key(project_id), mapping={"project": _dump(project), "assets": b"[]", "version": 1})
+
+    async def get_project(self, project_id: str) -> Optional[Project]:
+        raw = await self.redis.hget(self._key(project_id), "project")
+        return Project.model_validate_json(raw) if raw else None
+
+    async def get_script(self, project_id: str) -> Optional[Script]:
+        raw = await self.redis.hget(self._key(project_id), "script")
+        return Script.model_validate_json(raw) if raw else None
+
+    async def set_script(self, project_id: str, script: Script):
+        key = self._key(project_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, "script", _dump(script))
+            pipe.hincrby(key, "version", 1)
+            await pipe.execute()
+
+    async def add_assets(self, project_id: str, assets: List[MediaAsset]):
+        if assets:
+            await self._append_assets(keys=[self._key(project_id)], args=[b",".join(_dump(a) for a in assets)])
+
+    async def snapshot(self, project_id: str) -> Optional[Tuple[int, bytes]]:
+        """Return (version, serialized body) or None if the project is unknown"""
+        fields = await self.redis.hgetall(self._key(project_id))
+        if b"project" not in fields:
+            return None
+        # Fields are already JSON; splice them together without decoding
+        body = b"".join((
+            b'{"project":', fields[b"project"],
+            b',"script":', fields.get(b"script", b"null"),
+            b',"assets":', fields.get(b"assets", b"[]"),
+            b',"render":', fields.get(b"render", b"null"),
+            b"}",
+        ))
+        return int(fields[b"version"]), body
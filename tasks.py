@@ -0,0 +1,246 @@
+"""
+Background generation tasks
+
+Script, image and voice generation run on Celery workers when REDIS_URL is set:
+    celery -A tasks worker -Q cpu_queue    # script + voice
+    celery -A tasks worker -Q gpu_queue    # diffusion calls
+Without a broker the API calls the same builders in-process.
+Each task writes its result through the RedisStore and publishes the outcome
+on project:{id} itself, so completion never depends on the API process.
+"""
+
+import asyncio
+import os
+import random
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import httpx
+import orjson
+import redis.asyncio as aioredis
+from celery import Celery
+from celery.utils.log import get_task_logger
+
+from schemas import Script, ScriptSegment, MediaAsset
+from store import RedisStore, project_channel
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Diffusion backend (Stable Diffusion / Forge / Flux gateway); placeholders are used when unset
+SD_API_URL = os.getenv("SD_API_URL")
+SD_API_KEY = os.getenv("SD_API_KEY")
+# Diffusion batches take far longer than ordinary API calls
+SD_TIMEOUT = httpx.Timeout(60.0, connect=3.0)
+# TTS backend (ElevenLabs / Polly gateway returning {"url": "..."}); placeholder voice when unset
+TTS_API_URL = os.getenv("TTS_API_URL")
+TTS_API_KEY = os.getenv("TTS_API_KEY")
+
+# No result backend: tasks persist their own results and nothing reads them back
+celery_app = Celery("shorts", broker=REDIS_URL)
+celery_app.conf.update(
+    task_serializer="json",
+    accept_content=["json"],
+    task_ignore_result=True,
+    task_routes={
+        "tasks.generate_script_task": {"queue": "cpu_queue"},
+        "tasks.voice_task": {"queue": "cpu_queue"},
+        "tasks.ai_images_task": {"queue": "gpu_queue"},
+    },
+)
+
+HP_GIFS = (
+    "https://media.tenor.com/1.gif",
+    "https://media.tenor.com/2.gif",
+    "https://media.tenor.com/3.gif",
+)
+GOT_GIFS = (
+    "https://media.tenor.com/a.gif",
+    "https://media.tenor.com/b.gif",
+    "https://media.tenor.com/c.gif",
+)
+GENERIC_GIFS = (
+    "https://media.tenor.com/x.gif",
+    "https://media.tenor.com/y.gif",
+    "https://media.tenor.com/z.gif",
+)
+
+_TTS_PLACEHOLDER_URL = "https://cdn.pixabay.com/download/audio/2022/02/23/audio_6b3c.mp3?filename=neutral-female-voiceover-sample.mp3"
+
+# fandom -> (placeholder pool, prompts); unknown fandoms fall back to "generic"
+FANDOM_TABLE: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    "harry_potter": (HP_GIFS, ("wand sparks", "hogwarts castle night", "patronus mist")),
+    "game_of_thrones": (GOT_GIFS, ("dragon flight", "winterfell snow drift", "sword sparks")),
+    "generic": (GENERIC_GIFS, ("magic particles", "fantasy landscape", "mystic smoke")),
+}
+
+_rng = random.Random()
+
+logger = get_task_logger(__name__)
+
+# =============================================================================
+# BUILDERS (shared by the API and the workers)
+# =============================================================================
+
+@lru_cache(maxsize=4096)
+def _script_for_topic(topic: str) -> Tuple[str, Tuple[Tuple[float, float, str], ...]]:
+    """Simple templated script 45-60s, memoized per topic
+
+    Only immutable (start, end, text) tuples are cached; build_script makes
+    fresh ScriptSegment models so no two scripts share mutable state.
+
+    Deterministic today; once an LLM sits behind this, move the cache to Redis
+    keyed by hashlib.blake2b(topic.encode(), digest_size=16).hexdigest().
+    """
+    bullets = [
+        "Hook: a jaw-dropping reveal in 5 seconds",
+        "Point 1: surprising lore detail",
+        "Point 2: fan theory twist",
+        "Point 3: what most fans miss",
+        "CTA: follow for more in-universe secrets"
+    ]
+    text = (f"Topic: {topic}\n" + "\n".join(f"- {b}" for b in bullets))
+    # Segments across ~55s
+    segments = (
+        (0.0, 5.0, "Hook"),
+        (5.0, 20.0, "Point 1"),
+        (20.0, 35.0, "Point 2"),
+        (35.0, 50.0, "Point 3"),
+        (50.0, 58.0, "CTA"),
+    )
+    return text, segments
+
+def build_script(project_id: str, topic: str) -> Script:
+    text, segments = _script_for_topic(topic)
+    segs = [ScriptSegment.model_construct(start=start, end=end, text=t) for start, end, t in segments]
+    return Script.model_construct(project_id=project_id, text=text, segments=segs)
+
+def placeholder_images(pool: Sequence[str]) -> List[str]:
+    return _rng.sample(pool, k=min(3, len(pool)))
+
+def build_image_assets(project_id: str, fandom: str, urls: Sequence[str], prompts: Sequence[str]) -> List[MediaAsset]:
+    # urls come from placeholders or sd_urls, prompts from AIImagesReq; both are already checked
+    return [
+        MediaAsset.model_construct(project_id=project_id, kind="image", url=url, meta={"prompt": p, "fandom": fandom})
+        for url, p in zip(urls, prompts)
+    ]
+
+def build_voice_asset(project_id: str, voice: str = "female_neutral", url: Optional[str] = None) -> MediaAsset:
+    # placeholder TTS unless a provider URL (checked by tts_url) is given
+    return MediaAsset.model_construct(project_id=project_id, kind="voice", url=url or _TTS_PLACEHOLDER_URL, meta={"voice": voice, "lang": "en-US"})
+
+def _auth_headers(api_key: Optional[str]) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+def sd_request(prompts: Sequence[str]):
+    """Return (payload, headers) for one batched diffusion call"""
+    # n_iter=1 + batch_size=N lets Forge/Flux style backends render the whole batch in one pass
+    payload = {"prompts": list(prompts), "batch_size": len(prompts), "n_iter": 1}
+    return payload, _auth_headers(SD_API_KEY)
+
+def tts_request(text: str, voice: str):
+    """Return (payload, headers) for one voice synthesis call"""
+    return {"text": text, "voice": voice}, _auth_headers(TTS_API_KEY)
+
+def sd_urls(data: Any, expected: int) -> List[str]:
+    """Extract the image URLs from a provider body; ValueError on any bad shape"""
+    urls = data.get("urls") if isinstance(data, dict) else None
+    if not isinstance(urls, list):
+        raise ValueError("provider response has no urls list")
+    if len(urls) != expected:
+        raise ValueError(f"expected {expected} images, got {len(urls)}")
+    if not all(isinstance(url, str) and url for url in urls):
+        raise ValueError("provider returned a non-string image url")
+    return urls
+
+def tts_url(data: Any) -> str:
+    """Extract the audio URL from a provider body; ValueError on any bad shape"""
+    url = data.get("url") if isinstance(data, dict) else None
+    if not isinstance(url, str) or not url:
+        raise ValueError("provider response has no url string")
+    return url
+
+# =============================================================================
+# CELERY TASKS
+# =============================================================================
+
+_sd_client: Optional[httpx.Client] = None
+
+def _client() -> httpx.Client:
+    # One pooled client per worker process for provider calls
+    global _sd_client
+    if _sd_client is None:
+        _sd_client = httpx.Client(
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            timeout=SD_TIMEOUT,
+        )
+    return _sd_client
+
+Result = Union[Script, List[MediaAsset]]
+
+async def _persist(project_id: str, kind: str, result: Optional[Result], message: Dict[str, Any]):
+    redis = aioredis.Redis.from_url(REDIS_URL)
+    try:
+        if result is not None:
+            store = RedisStore(redis)
+            if kind == "script":
+                await store.set_script(project_id, result)
+            else:
+                await store.add_assets(project_id, result)
+        await redis.publish(project_channel(project_id), orjson.dumps(message))
+    finally:
+        await redis.aclose()
+
+# /ws/{project_id} is unauthenticated, so subscribers only ever see these;
+# the exception itself (provider URLs, hostnames) stays in the worker log
+_TASK_ERRORS = {
+    "script": "Script generation error",
+    "images": "Image provider error",
+    "voice": "Voice provider error",
+}
+
+def _complete(project_id: str, kind: str, task_id: str, build: Callable[[], Result]):
+    """Run build(), store its result and notify /ws/{project_id} subscribers"""
+    message: Dict[str, Any] = {"task_id": task_id, "kind": kind}
+    try:
+        result = build()
+    except Exception:
+        logger.exception("%s task %s failed for project %s", kind, task_id, project_id)
+        message.update(status="error", error=_TASK_ERRORS[kind])
+        asyncio.run(_persist(project_id, kind, None, message))
+        raise
+    # A failure here propagates as-is; there is nothing left to report it through
+    message["status"] = "done"
+    asyncio.run(_persist(project_id, kind, result, message))
+
+@celery_app.task(bind=True)
+def generate_script_task(self, project_id: str, topic: str):
+    _complete(project_id, "script", self.request.id, lambda: build_script(project_id, topic))
+
+def _images(project_id: str, fandom: str, prompts: Optional[List[str]]) -> List[MediaAsset]:
+    pool, default_prompts = FANDOM_TABLE.get(fandom, FANDOM_TABLE["generic"])
+    prompts = prompts or default_prompts
+    if SD_API_URL:
+        payload, headers = sd_request(prompts)
+        resp = _client().post(SD_API_URL, json=payload, headers=headers)
+        resp.raise_for_status()
+        urls = sd_urls(resp.json(), len(prompts))
+    else:
+        urls = placeholder_images(pool)
+    return build_image_assets(project_id, fandom, urls, prompts)
+
+@celery_app.task(bind=True)
+def ai_images_task(self, project_id: str, fandom: str, prompts: Optional[List[str]] = None):
+    _complete(project_id, "images", self.request.id, lambda: _images(project_id, fandom, prompts))
+
+def _voice(project_id: str, voice: str, text: Optional[str]) -> List[MediaAsset]:
+    url = None
+    if TTS_API_URL:
+        payload, headers = tts_request(text, voice)
+        resp = _client().post(TTS_API_URL, json=payload, headers=headers)
+        resp.raise_for_status()
+        url = tts_url(resp.json())
+    return [build_voice_asset(project_id, voice, url)]
+
+@celery_app.task(bind=True)
+def voice_task(self, project_id: str, voice: str, text: Optional[str] = None):
+    _complete(project_id, "voice", self.request.id, lambda: _voice(project_id, voice, text))